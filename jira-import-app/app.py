@@ -1,234 +1,259 @@
+import gzip
 import os
 import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
 from flask import Flask, request, render_template, url_for, send_file, abort
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 
-# Define the upload folder
+# Define the upload folder and create it (plus the processed
+# subdirectory) once at import instead of on every request
 UPLOAD_FOLDER = os.path.join(os.getcwd(), "uploads")
+PROCESSED_DIR = os.path.join(UPLOAD_FOLDER, "processed")
+os.makedirs(PROCESSED_DIR, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
+# When fronted by nginx/Apache with X-Sendfile support, let the kernel
+# stream downloads zero-copy instead of chunking them through Python
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true")
 
-def preprocess(data):
+
+def process_dataframe(data):
     """
-    Processes the initial DataFrame by removing rows and columns based on
-    pre-defined criteria, and adjusts the DataFrame to a suitable format
-    for further processing.
+    Runs the whole transformation in one pass: cleans the raw upload,
+    splits Epics from Stories, fans each Story out into its component
+    rows, and resolves epic estimates and components while the output
+    frame is being built, so no intermediate result-sized frame is
+    created or re-traversed afterwards.
     """
-    # Remove the first row (the row with "As a user I need to"),
-    # the 'C' columns (indicated by 'Unnamed: 3, 5, and 7'),
-    # and keep only the first 6 columns
     if data.empty or data.shape[0] < 2:
         raise ValueError(
             "Input data is empty or doesn't have enough rows for processing."
         )
 
-    data.drop(index=0, inplace=True, errors="ignore")
-    for col_to_drop in ["Unnamed: 3", "Unnamed: 5", "Unnamed: 7"]:
-        if col_to_drop in data.columns:
-            data.drop(columns=[col_to_drop], inplace=True, errors="ignore")
-    data = data.iloc[:, :6]
-
-    # Remove empty rows
-    data.dropna(how="all", inplace=True)
-
-    # Reset the index after dropping rows
-    data.reset_index(drop=True, inplace=True)
+    # The unused confidence columns are already skipped at parse time via
+    # usecols, so only the instruction row and empty rows remain to drop
+    data = (
+        data.drop(index=0, errors="ignore")
+        .dropna(how="all")
+        .reset_index(drop=True)
+    )
 
-    # Ensure 'EPIC' column exists
+    # The upload path guarantees these columns via usecols at read time;
+    # the checks stay as defense for frames built by other callers
     if "EPIC" not in data.columns:
         raise ValueError(
             "'EPIC' column not found in the input data. Ensure the input format is correct."
         )
 
-    # Locate 'END' in the 'EPIC' column
-    if "END" in data["EPIC"].values:
-        end_index = data[data["EPIC"] == "END"].index[0]
-        data = data[:end_index]
-    else:
+    required_cols = {"EPIC", "SUMMARY", "IOS", "AND", "SERV", "NOTES"}
+    if not required_cols.issubset(data.columns):
+        raise ValueError(
+            f"Input data does not have the required columns: {required_cols}"
+        )
+
+    # Locate 'END' in the 'EPIC' column; argmax on the boolean mask gives
+    # the first match in one scan without materializing a filtered frame
+    end_mask = data["EPIC"].eq("END").to_numpy(dtype=bool, na_value=False)
+    if not end_mask.any():
         raise ValueError(
             "The word 'END' is not found in the EPIC column. Ensure 'END' exists in your input data."
         )
+    data = data.iloc[: end_mask.argmax()].copy()
+
+    # Carry the owning Epic down onto its Story rows so the aggregations
+    # below can group per-epic without tracking state row by row
+    data["_epic_key"] = data["EPIC"].ffill()
+
+    # Coerce the estimate columns to numeric once so the per-epic totals
+    # and component presence can be aggregated in a single C-level groupby.
+    # to_numeric's Arrow path misaligns or NaN-poisons columns that mix
+    # nulls with non-numeric cells (pandas 2.2.x), so coerce through
+    # plain float64 - where every bad cell is an ordinary NaN - and cast
+    # back to Arrow, which maps those NaNs to proper nulls
+    for col in ("IOS", "AND", "SERV"):
+        data[col] = (
+            pd.to_numeric(data[col], errors="coerce")
+            .astype("float64")
+            .astype("double[pyarrow]")
+        )
 
-    return data
+    is_epic = data["EPIC"].notna()
+    is_story = ~is_epic & data["SUMMARY"].notna()
 
+    orphaned = is_story & data["_epic_key"].isna()
+    if orphaned.any():
+        raise ValueError(
+            f"Story row at index {int(orphaned.idxmax())} does not have an associated Epic. Ensure all Stories follow an Epic in the CSV."
+        )
 
-def dataframeprocess(data):
-    """
-    Processes each row of the DataFrame to construct a structured format for JIRA issues bulk import
-    purposes, separating Epics and Stories and calculating estimates.
-    """
+    epics = data.loc[is_epic]
+    epic_names = epics["EPIC"]
 
-    # Expected columns: EPIC, SUMMARY, IOS, AND, SERV, NOTES
-    required_cols = {"EPIC", "SUMMARY", "IOS", "AND", "SERV", "NOTES"}
-    if not required_cols.issubset(data.columns):
+    # Epic names key every per-epic lookup below, so repeats would
+    # attribute one epic's stories to another; reject them up front
+    duplicated = epic_names.duplicated()
+    if duplicated.any():
         raise ValueError(
-            f"Input data does not have the required columns: {required_cols}"
+            f"Duplicate Epic name '{epic_names[duplicated].iloc[0]}' found in the EPIC column. Epic names must be unique."
         )
 
-    current_epic_name = ""
-    epic_estimates = {}
-    epic_components_tracker = {}
-    columns = [
-        "Issue Type",
-        "Epic Name",
-        "Epic Link",
-        "Summary",
-        "Description",
-        "Components",
-        "Original Estimate",
-    ]
-    final_data = pd.DataFrame(columns=columns)
-
-    data_rows = []
-    for index, row in data.iterrows():
-        if pd.notna(row["EPIC"]):
-            # This row is an Epic
-            current_epic_name = row["EPIC"]
-            epic_estimates[current_epic_name] = 0  # Initialize epic estimate
-            epic_components_tracker[current_epic_name] = {
-                "Android": False,
-                "iOS": False,
-                "Server": False,
-            }
-            data_rows.append(
-                {
-                    "Issue Type": "Epic",
-                    "Epic Name": row["EPIC"],
-                    "Epic Link": "",
-                    "Summary": row["SUMMARY"],
-                    "Description": row["NOTES"],
-                    "Components": "",
-                    "Original Estimate": "",
-                }
-            )
-        elif pd.notna(row["SUMMARY"]):
-            if not current_epic_name:
-                raise ValueError(
-                    f"Story row at index {index} does not have an associated Epic. Ensure all Stories follow an Epic in the CSV."
-            )
-
-            story_estimates = []
-            # Server
-            if pd.notna(row["SERV"]):
-                epic_components_tracker[current_epic_name]["Server"] = True
-                story_estimates.append(float(row["SERV"]))
-                data_rows.append(
-                    {
-                        "Issue Type": "Story",
-                        "Epic Name": "",
-                        "Epic Link": current_epic_name,
-                        "Summary": row["SUMMARY"],
-                        "Description": row["NOTES"],
-                        "Components": "Server",
-                        "Original Estimate": row["SERV"],
-                    }
-                )
-            # iOS
-            if pd.notna(row["IOS"]):
-                epic_components_tracker[current_epic_name]["iOS"] = True
-                story_estimates.append(float(row["IOS"]))
-                data_rows.append(
-                    {
-                        "Issue Type": "Story",
-                        "Epic Name": "",
-                        "Epic Link": current_epic_name,
-                        "Summary": row["SUMMARY"],
-                        "Description": row["NOTES"],
-                        "Components": "iOS",
-                        "Original Estimate": row["IOS"],
-                    }
-                )
-            # Android
-            if pd.notna(row["AND"]):
-                epic_components_tracker[current_epic_name]["Android"] = True
-                story_estimates.append(float(row["AND"]))
-                data_rows.append(
-                    {
-                        "Issue Type": "Story",
-                        "Epic Name": "",
-                        "Epic Link": current_epic_name,
-                        "Summary": row["SUMMARY"],
-                        "Description": row["NOTES"],
-                        "Components": "Android",
-                        "Original Estimate": row["AND"],
-                    }
-                )
-
-            # Add to epic estimate sum
-            epic_estimates[current_epic_name] += sum(story_estimates)
-
-    final_data = pd.concat([final_data, pd.DataFrame(data_rows)], ignore_index=True)
-    return final_data, epic_estimates, epic_components_tracker
-
-
-def postprocess(final_data, epic_estimates, epic_components_tracker):
-    """
-    Applies final transformations to the DataFrame, updating estimates,
-    converting data types, and adjusting component values. 
-    It also duplicates the components into two new columns.
-    """
-    # Update Epic estimates in final_data
-    for index, row in final_data.iterrows():
-        if row["Issue Type"] == "Epic" and row["Epic Name"] in epic_estimates:
-            final_data.at[index, "Original Estimate"] = epic_estimates[row["Epic Name"]]
-
-    # Convert all 'Original Estimate' values to float
-    for idx in final_data.index:
-        val = final_data.at[idx, "Original Estimate"]
-        if val == "":
-            val = 0
-        final_data.at[idx, "Original Estimate"] = float(val)
-
-    # Convert days to seconds (1 day = 8 hours, 1 hour = 3600 seconds)
-    final_data["Original Estimate"] = final_data["Original Estimate"] * 8 * 3600
-
-    # Round values
+    # Per-epic estimate totals and component presence, both kept as
+    # Series keyed by epic name so the epic rows can resolve them via
+    # map while they are being built. Only Story rows count: stray
+    # estimate values on an Epic's own row or on summary-less rows must
+    # not leak into the totals. Reindexing over the epic names gives
+    # story-less epics an explicit zero/absent default
+    stories_only = data.loc[is_story]
+    epic_totals = (
+        stories_only.groupby("_epic_key")[["IOS", "AND", "SERV"]]
+        .sum()
+        .sum(axis=1)
+        .reindex(epic_names, fill_value=0)
+    )
+    presence = (
+        stories_only[["AND", "IOS", "SERV"]]
+        .notna()
+        .groupby(stories_only["_epic_key"])
+        .any()
+        .reindex(epic_names, fill_value=False)
+    )
+    epic_df = pd.DataFrame(
+        {
+            "Issue Type": "Epic",
+            "Epic Name": epic_names,
+            "Epic Link": "",
+            "Summary": epics["SUMMARY"],
+            "Description": epics["NOTES"],
+            "Components": epic_names.map(
+                presence["AND"].map({True: "Android", False: ""})
+            ),
+            "Original Estimate": epic_names.map(epic_totals),
+            "Components 1": epic_names.map(
+                presence["IOS"].map({True: "iOS", False: ""})
+            ),
+            "Components 2": epic_names.map(
+                presence["SERV"].map({True: "Server", False: ""})
+            ),
+            "_row": epics.index,
+            "_sub": -1,
+        }
+    )
+
+    # Each story row fans out into up to three component rows; melt does
+    # the whole reshape in one C-level pass and dropna removes the
+    # components a story has no estimate for
+    stories = data.loc[
+        is_story, ["_epic_key", "SUMMARY", "NOTES", "SERV", "IOS", "AND"]
+    ].reset_index(names="_row")
+    melted = stories.melt(
+        id_vars=["_row", "_epic_key", "SUMMARY", "NOTES"],
+        value_vars=["SERV", "IOS", "AND"],
+        var_name="_comp",
+        value_name="_estimate",
+    ).dropna(subset=["_estimate"])
+    story_components = melted["_comp"].map(
+        {"SERV": "Server", "IOS": "iOS", "AND": "Android"}
+    )
+    story_df = pd.DataFrame(
+        {
+            "Issue Type": "Story",
+            "Epic Name": "",
+            "Epic Link": melted["_epic_key"],
+            "Summary": melted["SUMMARY"],
+            "Description": melted["NOTES"],
+            "Components": story_components,
+            "Original Estimate": melted["_estimate"],
+            "Components 1": story_components,
+            "Components 2": story_components,
+            "_row": melted["_row"],
+            "_sub": melted["_comp"].map({"SERV": 0, "IOS": 1, "AND": 2}),
+        }
+    )
+
+    # Leave empty halves out of the concat: combining with an all-NA
+    # frame hits pandas' deprecated dtype-reconciliation path. Fall back
+    # to epic_df when both are empty so the output keeps its columns
+    frames = [frame for frame in (epic_df, story_df) if not frame.empty]
+    final_data = (
+        pd.concat(frames or [epic_df], ignore_index=True)
+        .sort_values(["_row", "_sub"], kind="stable")
+        .drop(columns=["_row", "_sub"])
+        .reset_index(drop=True)
+    )
+
+    # The broadcast '' constants drag these columns to object dtype;
+    # bring them back onto the Arrow backend so the frame stays
+    # Arrow-native all the way to the writer
+    final_data = final_data.astype(
+        {"Epic Name": "string[pyarrow]", "Epic Link": "string[pyarrow]"}
+    )
+
+    # Convert days to seconds (1 day = 8 hours, 1 hour = 3600 seconds);
+    # both halves of the column are numeric already, so this is a single
+    # vectorized scale-and-round
+    estimate = pd.to_numeric(final_data["Original Estimate"], errors="coerce").fillna(
+        0
+    )
     final_data["Original Estimate"] = (
-        final_data["Original Estimate"].round().astype(int)
+        (estimate * 8 * 3600).round().astype("int32[pyarrow]")
     )
 
-    # Add two new 'Components' columns
-    final_data["Components 1"] = final_data["Components"]
-    final_data["Components 2"] = final_data["Components"]
-
-    # Update Components for Epics based on the tracker
-    for index, row in final_data.iterrows():
-        if row["Issue Type"] == "Epic":
-            epic_name = row["Epic Name"]
-            android = "Android" if epic_components_tracker[epic_name]["Android"] else ""
-            ios = "iOS" if epic_components_tracker[epic_name]["iOS"] else ""
-            server = "Server" if epic_components_tracker[epic_name]["Server"] else ""
-            final_data.at[index, "Components"] = android
-            final_data.at[index, "Components 1"] = ios
-            final_data.at[index, "Components 2"] = server
+    # These label columns have only a handful of distinct values, so a
+    # categorical dtype stores each cell as a small code while the
+    # writer still emits the plain string labels
+    for column in ("Issue Type", "Components", "Components 1", "Components 2"):
+        final_data[column] = final_data[column].astype("category")
 
     return final_data
 
 
-def preprocess_file(input_filepath):
+def preprocess_file(input_file, original_filename):
     """
-    This function now performs the full specialized transformation
-    rather than just adding a 'Processed' column.
+    Runs the full specialized transformation on an uploaded CSV stream
+    and writes the processed result next to the other uploads.
     """
-    # Load initial data
-    data = pd.read_csv(input_filepath, header=0)
+    # Parse straight from the upload stream with the multithreaded
+    # pyarrow parser, so the raw input is never written to disk; the
+    # Arrow-backed columns also keep strings out of the object dtype.
+    # usecols means the blank estimate-confidence columns between the
+    # named ones are never parsed or allocated at all. A file missing
+    # any of the named columns fails inside the reader, so re-raise
+    # that as the ValueError the upload route reports to the user
+    required_cols = ["EPIC", "SUMMARY", "SERV", "IOS", "AND", "NOTES"]
+    try:
+        data = pd.read_csv(
+            input_file,
+            header=0,
+            usecols=required_cols,
+            engine="pyarrow",
+            dtype_backend="pyarrow",
+        )
+    except pa.lib.ArrowKeyError as exc:
+        raise ValueError(
+            f"Input data does not have the required columns: {set(required_cols)}"
+        ) from exc
 
-    # Run the specialized processing pipeline
-    data = preprocess(data)
-    final_data, epic_estimates, epic_components_tracker = dataframeprocess(data)
-    final_data = postprocess(final_data, epic_estimates, epic_components_tracker)
+    # Run the fused processing pipeline
+    final_data = process_dataframe(data)
 
     # Generate unique filename using timestamp
     timestamp = int(time.time())
-    base_name = os.path.basename(input_filepath)
-    name, ext = os.path.splitext(base_name)
-    output_filename = f"{name}_{timestamp}_processed{ext}"
-    output_filepath = os.path.join(os.path.dirname(input_filepath), output_filename)
-
-    final_data.to_csv(output_filepath, index=False, encoding="utf-8-sig")
+    name, ext = os.path.splitext(original_filename)
+    output_filename = f"{name}_{timestamp}_processed{ext}.gz"
+    output_filepath = os.path.join(app.config["UPLOAD_FOLDER"], output_filename)
+
+    # Arrow's CSV writer streams the table out without going through
+    # Python-level formatting; write the BOM by hand to keep the
+    # utf-8-sig encoding the import tooling expects. The output is
+    # gzipped at write time so downloads ship the compressed bytes
+    table = pa.Table.from_pandas(final_data, preserve_index=False)
+    with gzip.open(output_filepath, "wb") as output_file:
+        output_file.write(b"\xef\xbb\xbf")
+        pa.csv.write_csv(table, output_file)
     return output_filepath
 
 
@@ -236,9 +261,7 @@ def upload_to_bucket(blob_name, file_path):
     """
     Simulate uploading by moving the file to a processed directory.
     """
-    local_output_dir = os.path.join(app.config["UPLOAD_FOLDER"], "processed")
-    os.makedirs(local_output_dir, exist_ok=True)  # Ensure directory exists
-    output_path = os.path.join(local_output_dir, blob_name)
+    output_path = os.path.join(PROCESSED_DIR, blob_name)
     os.rename(file_path, output_path)  # Move the file
     return output_path  # Return the correct full path
 
@@ -252,15 +275,12 @@ def upload_file():
         if file.filename == "":
             return "No selected file", 400
 
-        upload_folder = app.config["UPLOAD_FOLDER"]
-        os.makedirs(upload_folder, exist_ok=True)
         filename = secure_filename(file.filename)
-        input_filepath = os.path.join(upload_folder, filename)
-        file.save(input_filepath)
 
-        # Process the file with the specialized transformations
+        # Process the upload straight from its stream; only the
+        # processed output ever touches disk
         try:
-            processed_file = preprocess_file(input_filepath)
+            processed_file = preprocess_file(file.stream, filename)
         except ValueError as e:
             # Show error if there’s a formatting error(e.g., 'END' not found)
             return f"Error processing file: {e}", 400
@@ -275,10 +295,22 @@ def upload_file():
 
 @app.route("/uploads/processed/<filename>")
 def processed_file(filename):
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], "processed", filename)
+    file_path = os.path.join(PROCESSED_DIR, filename)
     if not os.path.exists(file_path):
         abort(404, description="File not found")
-    return send_file(file_path, as_attachment=True)
+    # conditional=True routes through the WSGI file wrapper so servers
+    # like gunicorn/uWSGI can use sendfile(2); the pre-gzipped file is
+    # served as-is with Content-Encoding so browsers store the plain CSV
+    response = send_file(
+        file_path,
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=filename.removesuffix(".gz"),
+        conditional=True,
+    )
+    if filename.endswith(".gz"):
+        response.headers["Content-Encoding"] = "gzip"
+    return response
 
 
 if __name__ == "__main__":